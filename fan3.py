@@ -7,26 +7,34 @@ Fan controller with temperature curves and verbose logging.
   pcie / chassis / cpu / hdd
 - 温度来源：
   * LSI 9361-8i: storcli /c0 show temperature -> ROC
-  * 其他 PCIe: sensors -j 的 jc42-* temp1_input
-  * CPU: sensors -j 的 k10temp-* Tctl_input
-  * HDD(仅 SATA): smartctl -A 读取 190/194 温度，忽略 NVMe
+  * 其他 PCIe: sensors -u 的 jc42-* temp1_input（解析失败回退 sensors -j）
+  * CPU: sensors -u 的 k10temp-* Tctl_input
+  * HDD(仅 SATA): smartctl -n standby -j -A 读取温度（休眠盘不唤醒，沿用 30 分钟内的上次读数），忽略 NVMe
 - 日志：
-  * 详尽记录每一步（采样/计算/下发），RotatingFileHandler
+  * 详尽记录每一步（采样/计算/下发），QueueHandler 入队，后台线程写 RotatingFileHandler
   * 单文件最大 5MB，最多 3 份（当前 + 2 个历史）
-- 需要工具：ipmitool, lm-sensors, smartmontools, (可选) storcli
-- 建议 root 运行
+- 需要工具：ipmitool 或 freeipmi(ipmi-raw，优先), lm-sensors, smartmontools, (可选) storcli
+- 建议 root 运行，需要 Python 3.11+
 """
 
+import asyncio
+import atexit
+import bisect
 import json
 import os
+import queue
 import re
+import select
 import shlex
 import shutil
+import signal
 import subprocess
 import sys
+import tempfile
 import time
 import logging
-from logging.handlers import RotatingFileHandler
+from dataclasses import dataclass, replace
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from typing import Dict, List, Tuple, Optional
 
 # ------------------ 你的修正后 RAW 命令（最后一字节为速度 0x00~0x64） ------------------
@@ -50,14 +58,60 @@ MIN_PCT = { "pcie": 15, "chassis": 15, "cpu": 15, "hdd": 20 }
 BOOST_CHASSIS = 10   # 机箱风扇对 PCIE/CPU 气流增压
 SMOOTH_STEP = 5      # 每周期最大变化百分比
 POLL_INTERVAL = 5    # 秒
+FORCE_WRITE_EVERY = 12  # 目标不变时跳过下发，但每 N 轮全量重发一次，防 BMC 状态漂移
 CRITICAL = { "pcie": 85, "cpu": 85, "hdd": 57 }  # 超过拉满 100%
 
+# 批量下发脚本所在目录：一次 ipmitool exec / ipmi-raw --file 执行全部命令
+# 每次用随机名新建、用完即删；/run 不可写时回退到系统临时目录
+IPMI_SCRIPT_DIR = "/run"
+
+# IPMI 后端，启动时选定：优先 FreeIPMI ipmi-raw（启动开销更低），否则 ipmitool raw
+# IPMI_BACKEND + FAN_CMDS[name] + [速度] 即单条命令；去掉 IPMI_BACKEND[0] 即脚本中的一行
+# ipmi-raw 的首字节是 LUN，其余字节与 ipmitool raw 相同
+IPMI_BACKEND: List[str] = ["ipmitool", "raw"]
+IPMI_BATCH: List[str] = ["ipmitool", "exec"]   # + 脚本路径
+
+# 按后端预拼好的每路命令前缀（单条 argv / 脚本行），以及 0~100 的速度字节，循环中不再拼串
+HEX = tuple(f"0x{i:02x}" for i in range(101))
+FAN_ARGV: Dict[str, Tuple[str, ...]] = {}
+FAN_LINE: Dict[str, str] = {}
+
+def build_fan_cmds() -> None:
+    for name, raw in FAN_CMDS.items():
+        FAN_ARGV[name] = (*IPMI_BACKEND, *raw)
+        FAN_LINE[name] = " ".join(IPMI_BACKEND[1:] + raw)
+
+build_fan_cmds()
+
 # 日志默认：/var/log/fanctl.log（没权限自动回退到 ./fanctl.log）
 DEFAULT_LOG = "/var/log/fanctl.log"
 LOG_MAX_BYTES = 5 * 1024 * 1024   # 5MB
 LOG_BACKUPS = 2                   # 2 个历史 + 1 个当前 = 共 3 份
 
-STATE_LAST = {k: None for k in FAN_CMDS.keys()}
+# 采样解析用的正则，模块加载时编译一次
+_ROC_RE = re.compile(r"ROC temperature.*?(\d+)")
+_SENSORS_VAL_RE = re.compile(r"^  ([A-Za-z0-9_]+): ([-0-9.]+)$")
+
+# SATA 盘列表缓存：拓扑基本不变，每 _DISK_TTL 秒重新 lsblk 一次；SIGHUP 强制重扫
+_DISK_CACHE = {"t": 0.0, "v": []}
+_DISK_TTL = 300
+
+@dataclass(slots=True)
+class FanPcts:
+    # 四路风扇转速 %，字段名与 FAN_CMDS 的键一致；None = 尚未下发
+    pcie: Optional[int] = None
+    cpu: Optional[int] = None
+    hdd: Optional[int] = None
+    chassis: Optional[int] = None
+
+STATE_LAST = FanPcts()
+# 每块盘上次读到的 (温度, monotonic 时间)，盘休眠时沿用，但最多沿用 _HDD_STALE_MAX 秒
+_HDD_LAST: Dict[str, Tuple[float, float]] = {}
+_HDD_STALE_MAX = 1800
+STATE_TEMPS = {k: None for k in CRITICAL.keys()}   # 最近一轮采样温度，用于自适应轮询间隔
+# 外部工具路径，启动时由 resolve_tools() 解析一次（None = 未安装）
+TOOLS: Dict[str, Optional[str]] = {"storcli": None, "sensors": None, "smartctl": None, "lsblk": None,
+                                   "ipmitool": None, "ipmi-raw": None}
 log = logging.getLogger("fanctl")
 
 def setup_logging(log_file: Optional[str], max_bytes: int, backups: int, foreground: bool, level: int):
@@ -71,35 +125,88 @@ def setup_logging(log_file: Optional[str], max_bytes: int, backups: int, foregro
                             datefmt="%Y-%m-%d %H:%M:%S")
     fh = RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
     fh.setFormatter(fmt)
-    log.addHandler(fh)
+    handlers = [fh]
 
     if foreground:
         ch = logging.StreamHandler(sys.stdout)
         ch.setFormatter(fmt)
         ch.setLevel(level)
-        log.addHandler(ch)
+        handlers.append(ch)
+
+    # 控制循环里只入队，写文件/轮转/打印交给后台线程；退出时 stop() 把队列刷完
+    q = queue.SimpleQueue()
+    log.addHandler(QueueHandler(q))
+    listener = QueueListener(q, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
 
     log.info("==== fanctl started ====")
     log.info("log_file=%s max_bytes=%d backups=%d foreground=%s", log_path, max_bytes, backups, foreground)
+    resolve_tools()
+
+# 子进程统一参数：CPython 只有在 close_fds=False、无 preexec_fn/cwd/start_new_session、
+# 可执行文件为带目录的路径时才走 posix_spawn(vfork) 快路径，否则是 fork+exec，大内存主机上复制页表开销明显。
+# 本进程自己打开的 fd 默认不可继承（PEP 446），关掉 close_fds 不会泄漏日志文件/管道；
+# 命令一律用 resolve_tools() 解析出的绝对路径。
+SPAWN_KW = {"close_fds": False}
 
 def run(cmd: List[str], timeout: int = 8, check=False) -> subprocess.CompletedProcess:
-    return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout, check=check, text=True)
+    return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout, check=check, text=True,
+                          **SPAWN_KW)
+
+async def arun(cmd: List[str], timeout: int = 8, text: bool = True) -> subprocess.CompletedProcess:
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                                                **SPAWN_KW)
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), timeout)
+    except BaseException as e:
+        # 超时或被取消（SIGTERM/Ctrl-C）：杀掉子进程并读尽管道，不留孤儿和未关闭的管道
+        if proc.returncode is None:
+            proc.kill()
+        await proc.communicate()
+        if isinstance(e, asyncio.TimeoutError):
+            raise subprocess.TimeoutExpired(cmd, timeout) from None
+        raise
+    if text:
+        out, err = out.decode("utf-8", "replace"), err.decode("utf-8", "replace")
+    return subprocess.CompletedProcess(cmd, proc.returncode, out, err)
+
+async def gather_all(*coros) -> list:
+    # 同 asyncio.gather，但被取消时等全部子任务清理完（杀子进程）后才返回
+    async with asyncio.TaskGroup() as tg:
+        tasks = [tg.create_task(c) for c in coros]
+    return [t.result() for t in tasks]
 
 def which(cmd: str) -> Optional[str]:
     return shutil.which(cmd)
 
+def resolve_tools() -> None:
+    TOOLS["storcli"] = which("storcli64") or which("storcli")
+    for name in ("sensors", "smartctl", "lsblk", "ipmitool", "ipmi-raw"):
+        TOOLS[name] = which(name)
+    log.info("tools=%s posix_spawn=%s", TOOLS, getattr(subprocess, "_USE_POSIX_SPAWN", False))
+
+    if TOOLS["ipmi-raw"]:
+        IPMI_BACKEND[:] = [TOOLS["ipmi-raw"], "0x00"]
+        IPMI_BATCH[:] = [TOOLS["ipmi-raw"], "--file"]
+    elif TOOLS["ipmitool"]:
+        IPMI_BACKEND[:] = [TOOLS["ipmitool"], "raw"]
+        IPMI_BATCH[:] = [TOOLS["ipmitool"], "exec"]
+    build_fan_cmds()
+    log.info("ipmi backend: %s (batch: %s)", " ".join(IPMI_BACKEND), " ".join(IPMI_BATCH))
+
 # -------------------------- 传感器读取 --------------------------
 
-def read_storcli_roc() -> Optional[float]:
-    exe = which("storcli64") or which("storcli")
+async def read_storcli_roc() -> Optional[float]:
+    exe = TOOLS["storcli"]
     if not exe:
         log.debug("storcli not found")
         return None
     try:
         cmd = [exe, "/c0", "show", "temperature"]
         log.debug("exec: %s", shlex.join(cmd))
-        out = run(cmd).stdout
-        m = re.search(r"ROC temperature.*?(\d+)", out)
+        out = (await arun(cmd)).stdout
+        m = _ROC_RE.search(out)
         val = float(m.group(1)) if m else None
         log.info("storcli ROC temp = %s", val)
         return val
@@ -107,16 +214,45 @@ def read_storcli_roc() -> Optional[float]:
         log.warning("storcli read failed: %s", e)
         return None
 
-def sensors_json() -> Optional[dict]:
-    if not which("sensors"):
+def parse_sensors_u(out: str) -> Dict[str, Dict[str, Dict[str, float]]]:
+    # sensors -u 输出：芯片名 / Adapter / "Feature:" / "  tempN_xxx: 数值"，芯片之间空行分隔
+    # 解析成与 sensors -j 相同的 {chip: {feature: {key: value}}} 结构
+    data: Dict[str, Dict[str, Dict[str, float]]] = {}
+    chip = feat = None
+    for line in out.splitlines():
+        if not line.strip():
+            chip = feat = None
+            continue
+        if chip is None:
+            chip = line.strip()
+            data[chip] = {}
+            continue
+        m = _SENSORS_VAL_RE.match(line)
+        if m:
+            if feat is not None:
+                data[chip][feat][m.group(1)] = float(m.group(2))
+        elif line.endswith(":") and not line.startswith(" "):
+            feat = line[:-1]
+            data[chip][feat] = {}
+    return data
+
+async def sensors_flat() -> Optional[dict]:
+    if TOOLS["sensors"] is None:
         log.warning("sensors not found")
         return None
     try:
-        cmd = ["sensors","-j"]
+        cmd = [TOOLS["sensors"],"-u"]
         log.debug("exec: %s", shlex.join(cmd))
-        out = run(cmd).stdout
-        data = json.loads(out)
-        return data
+        data = parse_sensors_u((await arun(cmd)).stdout)
+        if data:
+            return data
+        log.debug("sensors -u gave nothing, fallback to -j")
+    except Exception as e:
+        log.warning("sensors -u failed: %s", e)
+    try:
+        cmd = [TOOLS["sensors"],"-j"]
+        log.debug("exec: %s", shlex.join(cmd))
+        return json.loads((await arun(cmd)).stdout)
     except Exception as e:
         log.warning("sensors -j failed: %s", e)
         return None
@@ -153,38 +289,58 @@ def get_jc42_max(sj: Optional[dict]) -> Optional[float]:
     log.debug("JC42 temps not found")
     return None
 
-def list_sata_disks() -> List[str]:
-    if not which("lsblk"):
+async def list_sata_disks() -> List[str]:
+    if _DISK_CACHE["t"] and time.monotonic() - _DISK_CACHE["t"] < _DISK_TTL:
+        log.debug("SATA disks (cached): %s", _DISK_CACHE["v"])
+        return _DISK_CACHE["v"]
+    if not TOOLS["lsblk"]:
         log.warning("lsblk not found")
         return []
     try:
-        out = run(["lsblk","-dn","-o","NAME,TRAN"]).stdout.strip().splitlines()
-        devs = []
-        for line in out:
-            parts = line.split()
-            if len(parts)>=2 and parts[1].lower()=="sata":
-                devs.append("/dev/"+parts[0])
+        data = json.loads((await arun([TOOLS["lsblk"],"-J","-d","-o","NAME,TRAN"])).stdout)
+        devs = ["/dev/"+d["name"] for d in data["blockdevices"] if (d.get("tran") or "").lower()=="sata"]
         log.info("SATA disks: %s", devs)
+        _DISK_CACHE.update(t=time.monotonic(), v=devs)
         return devs
     except Exception as e:
         log.warning("lsblk failed: %s", e)
         return []
 
-def smartctl_temp(dev: str) -> Optional[float]:
-    if not which("smartctl"):
+async def smartctl_temp(dev: str) -> Optional[float]:
+    if not TOOLS["smartctl"]:
         log.warning("smartctl not found")
         return None
     try:
-        cmd = ["smartctl","-A", dev]
+        # -n standby：盘在休眠时不唤醒，直接返回
+        cmd = [TOOLS["smartctl"],"-n","standby","-j","-A", dev]
         log.debug("exec: %s", shlex.join(cmd))
-        out = run(cmd).stdout
-        cand = []
-        for line in out.splitlines():
-            if re.search(r"\b(Temperature|Airflow_Temperature)\b", line, re.I):
-                nums = [int(x) for x in re.findall(r"(\d+)", line)]
-                if nums:
-                    cand.append(nums[-1])
+        r = await arun(cmd, text=False)
+        data = json.loads(r.stdout) if r.stdout.strip() else {}
+        # 退出码是位掩码：bit0 命令行错误；bit1 既可能是休眠跳过，也可能是打开设备/IDENTIFY 失败
+        if r.returncode & 0x03:
+            msgs = [str(m.get("string", "")) for m in data.get("smartctl", {}).get("messages", [])]
+            if r.returncode & 0x02 and any("STANDBY" in m.upper() or "SLEEP" in m.upper() for m in msgs):
+                last = _HDD_LAST.get(dev)
+                if last is not None and time.monotonic() - last[1] <= _HDD_STALE_MAX:
+                    log.info("HDD %s in standby, keep last temp = %s", dev, last[0])
+                    return last[0]
+                log.info("HDD %s in standby, no recent temp", dev)
+                return None
+            _HDD_LAST.pop(dev, None)
+            log.warning("smartctl failed on %s (rc=%d): %s", dev, r.returncode, " | ".join(msgs))
+            return None
+        cur = data.get("temperature", {}).get("current")
+        cand = [cur] if cur is not None else []
+        if not cand:
+            for attr in data.get("ata_smart_attributes", {}).get("table", []):
+                if attr.get("id") in (190, 194):
+                    # raw.value 高位可能打包了 Min/Max，取 raw.string 的首个数
+                    raw = attr.get("raw", {})
+                    tok = str(raw.get("string", "")).split()[:1]
+                    cand.append(int(tok[0]) if tok and tok[0].isdigit() else raw.get("value", 0) & 0xff)
         val = float(max(cand)) if cand else None
+        if val is not None:
+            _HDD_LAST[dev] = (val, time.monotonic())
         log.info("HDD temp %s = %s (candidates=%s)", dev, val, cand)
         return val
     except Exception as e:
@@ -193,16 +349,26 @@ def smartctl_temp(dev: str) -> Optional[float]:
 
 # -------------------------- 曲线/控制 --------------------------
 
-def lerp_curve(points: List[Tuple[float,float]], x: float) -> float:
+CurveTable = Tuple[Tuple[float, ...], Tuple[float, ...]]   # (xs 升序, ys)
+
+def curve_table(points: List[Tuple[float,float]]) -> CurveTable:
+    # 曲线在运行期不变：加载时排序一次，拆成 xs/ys，采样时不再重复排序
+    if not points: raise ValueError("curve must not be empty")
     points = sorted(points, key=lambda t: t[0])
-    if x <= points[0][0]: return points[0][1]
-    if x >= points[-1][0]: return points[-1][1]
-    for (x0,y0),(x1,y1) in zip(points, points[1:]):
-        if x0 <= x <= x1:
-            if x1==x0: return y1
-            t = (x - x0)/(x1 - x0)
-            return y0 + t*(y1 - y0)
-    return points[-1][1]
+    return tuple(float(p[0]) for p in points), tuple(float(p[1]) for p in points)
+
+def curve_tables(curves: Dict[str, List[Tuple[float,float]]]) -> Dict[str, CurveTable]:
+    return {k: curve_table(v) for k, v in curves.items()}
+
+def lerp_curve(table: CurveTable, x: float) -> float:
+    xs, ys = table
+    if x <= xs[0]: return ys[0]
+    if x >= xs[-1]: return ys[-1]
+    # 二分找区间：xs[i-1] < x <= xs[i]，因此 x1 > x0
+    i = bisect.bisect_left(xs, x)
+    x0, x1 = xs[i-1], xs[i]
+    t = (x - x0)/(x1 - x0)
+    return ys[i-1] + t*(ys[i] - ys[i-1])
 
 def clamp(v, lo, hi): return max(lo, min(hi, v))
 
@@ -214,50 +380,161 @@ def smooth(prev: Optional[int], target: int, step: int=SMOOTH_STEP) -> int:
 
 def set_fan_pct(name: str, pct: int, dry: bool=False) -> None:
     pct = clamp(int(round(pct)), 0, 100)
-    hexpct = f"0x{pct:02x}"
-    cmd = ["ipmitool","raw"] + FAN_CMDS[name] + [hexpct]
+    if getattr(STATE_LAST, name) == pct:
+        log.debug("SET %s unchanged at %d%%, skip", name, pct)
+        return
+    cmd = [*FAN_ARGV[name], HEX[pct]]
     log.info("SET %s -> %d%% (%s)", name, pct, " ".join(cmd))
-    STATE_LAST[name] = pct
+    setattr(STATE_LAST, name, pct)
     if dry:
-        log.info("[DRY-RUN] skip ipmitool for %s", name)
+        log.info("[DRY-RUN] skip ipmi for %s", name)
         return
     try:
         r = run(cmd, check=False)
         if r.returncode != 0:
-            log.warning("ipmitool %s -> %d%% failed: %s | %s", name, pct, r.stdout.strip(), r.stderr.strip())
+            log.warning("ipmi %s -> %d%% failed: %s | %s", name, pct, r.stdout.strip(), r.stderr.strip())
         else:
-            log.info("ipmitool %s -> %d%% ok: %s", name, pct, r.stdout.strip())
+            log.info("ipmi %s -> %d%% ok: %s", name, pct, r.stdout.strip())
     except Exception as e:
-        log.error("ipmitool %s -> %d%% exception: %s", name, pct, e)
-
-def compute_targets(curves, sj, dry, verbose=False) -> Dict[str,int]:
-    # 采样
-    log.info("=== sampling begin ===")
-    roc = read_storcli_roc()
-    jcmax = get_jc42_max(sj)
-    cpu = get_cpu_tctl(sj)
-
-    hdds = list_sata_disks()
-    htemps = []
-    for d in hdds:
-        t = smartctl_temp(d)
-        if t is not None:
-            htemps.append(t)
-    hdd = max(htemps) if htemps else None
-
-    log.info("sampled: roc=%s jc42_max=%s cpu=%s hdd_max=%s", roc, jcmax, cpu, hdd)
+        log.error("ipmi %s -> %d%% exception: %s", name, pct, e)
+
+# 常驻 ipmitool shell（仅 ipmitool 后端）：BMC 驱动只打开一次，省去每轮 fork+exec+打开 /dev/ipmi0
+_IPMI_SHELL: Optional[subprocess.Popen] = None
+_SHELL_MARK = "__fanctl_done__"
+_SHELL_FAILS = 0         # 连续失败次数，达到 _SHELL_MAX_FAILS 后不再使用 shell
+_SHELL_MAX_FAILS = 3
+
+def close_ipmi_shell() -> None:
+    global _IPMI_SHELL
+    if _IPMI_SHELL is None: return
+    proc, _IPMI_SHELL = _IPMI_SHELL, None
+    try:
+        proc.stdin.close()
+        proc.wait(timeout=2)
+    except Exception:
+        proc.kill()
+        proc.wait()
+
+atexit.register(close_ipmi_shell)
+
+def ipmi_shell_run(lines: List[str], timeout: int = 8) -> Optional[List[str]]:
+    # 每批命令后跟一条 echo 标记，读到标记行即本批结束；失败返回 None，由调用方回退到 exec
+    global _IPMI_SHELL, _SHELL_FAILS
+    if _SHELL_FAILS >= _SHELL_MAX_FAILS:
+        return None
+    try:
+        if _IPMI_SHELL is None or _IPMI_SHELL.poll() is not None:
+            if _IPMI_SHELL is not None:
+                log.warning("ipmitool shell exited (rc=%s), respawn", _IPMI_SHELL.returncode)
+            _IPMI_SHELL = subprocess.Popen([TOOLS["ipmitool"], "shell"], stdin=subprocess.PIPE,
+                                           stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0,
+                                           **SPAWN_KW)
+            log.info("ipmitool shell started (pid=%d)", _IPMI_SHELL.pid)
+        proc = _IPMI_SHELL
+        proc.stdin.write("".join(f"{line}\n" for line in lines + [f"echo {_SHELL_MARK}"]).encode())
+        fd = proc.stdout.fileno()
+        deadline = time.monotonic() + timeout
+        buf = b""
+        while True:
+            outs = [l.replace("ipmitool>", "").strip() for l in buf.decode("utf-8", "replace").split("\n")[:-1]]
+            if _SHELL_MARK in outs: break
+            left = deadline - time.monotonic()
+            if left <= 0 or not select.select([fd], [], [], left)[0]:
+                raise TimeoutError(f"no response in {timeout}s")
+            chunk = os.read(fd, 4096)
+            if not chunk: raise EOFError("ipmitool shell closed")
+            buf += chunk
+    except Exception as e:
+        _SHELL_FAILS += 1
+        log.warning("ipmitool shell failed (%d/%d): %s", _SHELL_FAILS, _SHELL_MAX_FAILS, e)
+        close_ipmi_shell()
+        if _SHELL_FAILS >= _SHELL_MAX_FAILS:
+            log.warning("ipmitool shell disabled, use %s", " ".join(IPMI_BATCH))
+        return None
+    _SHELL_FAILS = 0
+    # 去掉 readline 回显的命令行，只留各命令的输出
+    return [o for o in outs[:outs.index(_SHELL_MARK)] if not o.startswith(("raw ", "echo "))]
+
+def set_fans_batch(targets: FanPcts, dry: bool=False, force: bool=False) -> None:
+    global STATE_LAST
+    pcts = FanPcts(
+        pcie=   clamp(int(round(targets.pcie)),    0, 100),
+        cpu=    clamp(int(round(targets.cpu)),     0, 100),
+        hdd=    clamp(int(round(targets.hdd)),     0, 100),
+        chassis=clamp(int(round(targets.chassis)), 0, 100),
+    )
+    # 下发顺序：先机箱再分区；只下发有变化的风扇，force 时全量重发
+    fans = [(fan, pct) for fan, pct, last in (("chassis", pcts.chassis, STATE_LAST.chassis),
+                                              ("pcie",    pcts.pcie,    STATE_LAST.pcie),
+                                              ("cpu",     pcts.cpu,     STATE_LAST.cpu),
+                                              ("hdd",     pcts.hdd,     STATE_LAST.hdd))
+            if force or last != pct]
+    if not fans:
+        log.debug("SET all unchanged %s, skip", pcts)
+        return
+    lines = [f"{FAN_LINE[fan]} {HEX[pct]}" for fan, pct in fans]
+    for (fan, pct), line in zip(fans, lines):
+        log.info("SET %s -> %d%% (%s)", fan, pct, line)
+    if dry:
+        log.info("[DRY-RUN] skip ipmi batch")
+        STATE_LAST = pcts
+        return
 
-    # 计算 PCIe 热点
-    pcie_hot = None
-    for v in (roc, jcmax):
-        if v is not None:
-            pcie_hot = v if pcie_hot is None else max(pcie_hot, v)
-    log.info("pcie_hot = %s", pcie_hot)
+    # ipmitool 后端优先走常驻 shell，失败再回退到 ipmitool exec / ipmi-raw --file 脚本
+    outs = ipmi_shell_run(lines) if TOOLS["ipmi-raw"] is None and TOOLS["ipmitool"] else None
+    if outs is not None:
+        ok = not any(o.startswith("Unable to send") for o in outs)
+        detail = " | ".join(outs)
+    else:
+        # mkstemp：随机文件名 + O_EXCL + 0600，其他本地用户无法预建/软链/篡改脚本注入 IPMI 命令
+        script_dir = IPMI_SCRIPT_DIR if os.access(IPMI_SCRIPT_DIR, os.W_OK) else None
+        script = None
+        try:
+            fd, script = tempfile.mkstemp(prefix="fanctl-", suffix=".ipmi", dir=script_dir)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            cmd = IPMI_BATCH + [script]
+            log.debug("exec: %s", shlex.join(cmd))
+            r = run(cmd, check=False)
+        except Exception as e:
+            log.error("ipmi batch exception: %s", e)
+            return
+        finally:
+            if script:
+                try: os.unlink(script)
+                except OSError: pass
+        outs = r.stdout.splitlines()
+        ok = r.returncode == 0
+        detail = f"rc={r.returncode}: {r.stdout.strip()} | {r.stderr.strip()}"
+    # 每条命令输出一行，逐路对应记录
+    for i, (fan, pct) in enumerate(fans):
+        log.info("ipmi %s -> %d%%: %s", fan, pct, outs[i].strip() if i < len(outs) else "")
+    if not ok:
+        log.warning("ipmi batch failed (%s)", detail)
+        return
+    STATE_LAST = pcts
+
+def next_interval(base: int, prev: FanPcts, targets: FanPcts) -> int:
+    # 有风扇本轮按满步长上调：升温中，下一轮提前采样
+    if any(p is not None and t - p >= SMOOTH_STEP
+           for p, t in ((prev.pcie, targets.pcie), (prev.cpu, targets.cpu),
+                        (prev.hdd, targets.hdd), (prev.chassis, targets.chassis))):
+        return max(1, base // 2)
+    # 否则按距兜底温度的余量放宽：>20°C 4 倍，>10°C 2 倍
+    margins = [CRITICAL[k] - t for k, t in STATE_TEMPS.items() if t is not None]
+    headroom = min(margins) if margins else 0
+    if headroom > 20: return base * 4
+    if headroom > 10: return base * 2
+    return base
+
+def compute_pcts(tables: Dict[str, CurveTable], pcie_hot: Optional[float], cpu: Optional[float],
+                 hdd: Optional[float], prev: FanPcts) -> FanPcts:
+    # 温度 -> 各路目标转速（曲线、机箱增压/软上限、兜底、下限、平滑），不做采样/下发
 
     # 曲线映射
-    pcie_pct = lerp_curve(curves["pcie"], pcie_hot) if pcie_hot is not None else MIN_PCT["pcie"]
-    cpu_pct  = lerp_curve(curves["cpu"], cpu)       if cpu       is not None else MIN_PCT["cpu"]
-    hdd_pct  = lerp_curve(curves["hdd"], hdd)       if hdd       is not None else MIN_PCT["hdd"]
+    pcie_pct = lerp_curve(tables["pcie"], pcie_hot) if pcie_hot is not None else MIN_PCT["pcie"]
+    cpu_pct  = lerp_curve(tables["cpu"], cpu)       if cpu       is not None else MIN_PCT["cpu"]
+    hdd_pct  = lerp_curve(tables["hdd"], hdd)       if hdd       is not None else MIN_PCT["hdd"]
 
     # 机箱 = max(PCIE, CPU) + 加成
     chassis_pct = clamp(max(cpu_pct, pcie_pct) + BOOST_CHASSIS, 0, 100)
@@ -272,32 +549,46 @@ def compute_targets(curves, sj, dry, verbose=False) -> Dict[str,int]:
     log.info("curve raw: pcie=%s cpu=%s hdd=%s chassis=%s(+boost,soft-cap)",
              pcie_pct, cpu_pct, hdd_pct, chassis_pct)
 
-    # 兜底（可突破软上限）
-    if (pcie_hot is not None and pcie_hot >= CRITICAL["pcie"]):
-        pcie_pct = 100
-        chassis_pct = max(chassis_pct, 100)
-        log.warning("pcie critical -> pcie=100%% & chassis>=100%%")
-    if (cpu is not None and cpu >= CRITICAL["cpu"]):
-        cpu_pct = 100
-        chassis_pct = max(chassis_pct, 100)
-        log.warning("cpu critical -> cpu=100%% & chassis>=100%%")
-    if (hdd is not None and hdd >= CRITICAL["hdd"]):
+    # 兜底（可突破软上限）：pcie/cpu 过热时机箱也拉满
+    if pcie_hot is not None and pcie_hot >= CRITICAL["pcie"]:
+        pcie_pct = chassis_pct = 100
+        log.warning("pcie critical -> pcie=100% & chassis>=100%")
+    if cpu is not None and cpu >= CRITICAL["cpu"]:
+        cpu_pct = chassis_pct = 100
+        log.warning("cpu critical -> cpu=100% & chassis>=100%")
+    if hdd is not None and hdd >= CRITICAL["hdd"]:
         hdd_pct = 100
-        log.warning("hdd critical -> hdd=100%%")
-
-    # 最小转速下限
-    pcie_pct   = max(pcie_pct,   MIN_PCT["pcie"])
-    cpu_pct    = max(cpu_pct,    MIN_PCT["cpu"])
-    hdd_pct    = max(hdd_pct,    MIN_PCT["hdd"])
-    chassis_pct= max(chassis_pct,MIN_PCT["chassis"])
-
-    # 平滑
-    targets = {
-        "pcie":    smooth(STATE_LAST["pcie"],    int(round(pcie_pct))),
-        "cpu":     smooth(STATE_LAST["cpu"],     int(round(cpu_pct))),
-        "hdd":     smooth(STATE_LAST["hdd"],     int(round(hdd_pct))),
-        "chassis": smooth(STATE_LAST["chassis"], int(round(chassis_pct))),
-    }
+        log.warning("hdd critical -> hdd=100%")
+
+    # 最小转速下限 + 取整 + 平滑，一次完成
+    return FanPcts(
+        pcie=   smooth(prev.pcie,    int(round(max(pcie_pct,    MIN_PCT["pcie"])))),
+        cpu=    smooth(prev.cpu,     int(round(max(cpu_pct,     MIN_PCT["cpu"])))),
+        hdd=    smooth(prev.hdd,     int(round(max(hdd_pct,     MIN_PCT["hdd"])))),
+        chassis=smooth(prev.chassis, int(round(max(chassis_pct, MIN_PCT["chassis"])))),
+    )
+
+async def compute_targets(tables: Dict[str, CurveTable], dry, verbose=False) -> FanPcts:
+    # 采样：storcli / sensors / lsblk 并发，随后所有 SATA 盘的 smartctl 并发
+    log.info("=== sampling begin ===")
+    roc, sj, hdds = await gather_all(read_storcli_roc(), sensors_flat(), list_sata_disks())
+    jcmax = get_jc42_max(sj)
+    cpu = get_cpu_tctl(sj)
+
+    htemps = [t for t in await gather_all(*(smartctl_temp(d) for d in hdds)) if t is not None]
+    hdd = max(htemps) if htemps else None
+
+    log.info("sampled: roc=%s jc42_max=%s cpu=%s hdd_max=%s", roc, jcmax, cpu, hdd)
+
+    # 计算 PCIe 热点
+    pcie_hot = None
+    for v in (roc, jcmax):
+        if v is not None:
+            pcie_hot = v if pcie_hot is None else max(pcie_hot, v)
+    log.info("pcie_hot = %s", pcie_hot)
+    STATE_TEMPS.update(pcie=pcie_hot, cpu=cpu, hdd=hdd)
+
+    targets = compute_pcts(tables, pcie_hot, cpu, hdd, STATE_LAST)
     log.info("targets smoothed: %s", targets)
     log.info("=== sampling end ===")
     return targets
@@ -315,12 +606,15 @@ def usage():
     print(f"""Usage:
   sudo {sys.argv[0]} [--interval {POLL_INTERVAL}] [--config /path/curves.json] [--dry-run] [--once]
                     [--foreground] [--log-file /var/log/fanctl.log] [--log-max-mb 5] [--log-backups 2]
-                    [--verbose]
+                    [--verbose] [--force-write-every {FORCE_WRITE_EVERY}]
   sudo {sys.argv[0]} --set FAN PCT    # FAN in pcie|chassis|cpu|hdd, PCT 0-100
 
 Notes:
 - 日志按大小轮转：默认 5MB，备份 2 个（总 3 份：当前+2 历史）。
 - 如果想要“总计 4 份（当前+3 历史）”，把 --log-backups 设为 3 即可。
+- 目标转速不变时不重复下发；每 --force-write-every 轮（默认 {FORCE_WRITE_EVERY}）强制全量重发一次，设为 0 则不强制。
+- 轮询间隔自适应：距兜底温度余量 >20°C 时 4 倍 --interval，>10°C 时 2 倍；风扇正在满步长上调时减半。
+- SATA 盘列表缓存 5 分钟；换盘后可 kill -HUP 让下一轮立即重新扫描。
 """)
 
 def main():
@@ -335,6 +629,7 @@ def main():
     ap.add_argument("--log-file", type=str, default=None)
     ap.add_argument("--log-max-mb", type=int, default=5)
     ap.add_argument("--log-backups", type=int, default=LOG_BACKUPS)
+    ap.add_argument("--force-write-every", type=int, default=FORCE_WRITE_EVERY)
     ap.add_argument("--set", nargs=2, metavar=("FAN","PCT"))
     args, unknown = ap.parse_known_args()
 
@@ -353,20 +648,34 @@ def main():
     try:
         curves = load_curves(args.config)
         log.info("curves=%s", curves)
+        tables = curve_tables(curves)
         log.info("min=%s boost_chassis=%s step=%s", MIN_PCT, BOOST_CHASSIS, SMOOTH_STEP)
     except Exception as e:
         log.error("load curves failed: %s", e)
         sys.exit(1)
 
-    while True:
-        sj = sensors_json()
-        targets = compute_targets(curves, sj, args.dry_run, verbose=args.verbose)
-        # 先机箱再分区
-        for fan in ("chassis","pcie","cpu","hdd"):
-            set_fan_pct(fan, targets[fan], dry=args.dry_run)
-        if args.once: break
-        log.info("sleep %ds ...", max(1, args.interval))
-        time.sleep(max(1, args.interval))
+    async def loop():
+        aloop = asyncio.get_running_loop()
+        # systemctl kill -s HUP fanctl 可强制下一轮重新扫描磁盘
+        aloop.add_signal_handler(signal.SIGHUP, lambda: _DISK_CACHE.update(t=0.0))
+        # SIGTERM 取消主任务，正在运行的采样子进程随之被回收
+        aloop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        cycle = 0
+        while True:
+            targets = await compute_targets(tables, args.dry_run, verbose=args.verbose)
+            force = args.force_write_every > 0 and cycle % args.force_write_every == 0
+            prev = replace(STATE_LAST)
+            set_fans_batch(targets, args.dry_run, force=force)
+            cycle += 1
+            if args.once: break
+            interval = next_interval(max(1, args.interval), prev, targets)
+            log.info("sleep %ds ... (temps=%s)", interval, STATE_TEMPS)
+            await asyncio.sleep(interval)
+
+    try:
+        asyncio.run(loop())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        log.info("==== fanctl stopped ====")
 
 if __name__ == "__main__":
     if len(sys.argv)==1: